@@ -10,68 +10,315 @@ is documented here: https://github.com/ucdavis/metashape.
 
 from pathlib import Path
 import datetime
-import glob
-import re
+import time
+import json
+import tempfile
+import getpass
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import os
 import logging
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
+import queue
 import yaml
-import pandas as pd
-import numpy as np
 from shutil import copyfile
 import Metashape
-import requests
 from packaging import version
 
 
 
-from .read_yaml import read_yaml
-from .ImageMarkers import marker_detection, real_world_positions
+from .read_yaml import load_yaml, convert_paths_and_commands
 
 
-import pkg_resources
-import distutils.dist
-import io
+try:
+    from importlib.metadata import metadata as _pkg_metadata, version as _pkg_version
+except ImportError: # python < 3.8
+    from importlib_metadata import metadata as _pkg_metadata, version as _pkg_version
 
-am = pkg_resources.get_distribution('automated_metashape')
-metadata_str = am.get_metadata(am.PKG_INFO)
-metadata_obj = distutils.dist.DistributionMetadata()
-metadata_obj.read_pkg_file(io.StringIO(metadata_str))
+metadata_obj = _pkg_metadata('automated_metashape')
 
-__version__ = metadata_obj.version
-__author__ = metadata_obj.author
-__author_email__ = metadata_obj.author_email
-__repository__ = metadata_obj.url
+__version__ = metadata_obj.get('Version')
+__author__ = metadata_obj.get('Author')
+__author_email__ = metadata_obj.get('Author-email')
+__repository__ = metadata_obj.get('Home-page')
 
+# installed versions do not change during a run, so resolve them once
+_AM_VERSION = version.parse(__version__)
+_MS_VERSION = version.parse(_pkg_version('Metashape'))
+
+
+# Stages after which the project is saved, unless overridden by cfg["saveCheckpoints"]
+DEFAULT_CHECKPOINTS = frozenset(("buildPointCloud", "buildModel"))
+
+# All Metashape point classes, used to remove every point left visible by a filter.
+# Kept as a list since the Metashape API expects a list of ints.
+_ALL_POINT_CLASSES = list(range(128))
+
+_IMG_EXTS = ('.tif', '.jpg') # photo extensions picked up by add_photos (case-insensitive)
+
+# Keyword arguments accepted by each Metashape call, used to filter the stage configs
+_ALLOWED = {
+    "generateMasks": frozenset((
+        "path",
+        "masking_mode",
+        "mask_operation",
+        "tolerance",
+        "cameras",
+        "mask_defocus",
+        "fix_coverage",
+        "keypoint_limit",
+        "blur_threshold",
+        "mask_tiepoints",
+        )),
+    "analyzeImages": frozenset((
+        "cameras",
+        "filter_mask",
+        )),
+    "matchPhotos": frozenset((
+        "downscale",
+        "generic_preselection",
+        "reference_preselection",
+        "reference_preselection_mode",
+        "filter_mask",
+        "mask_tiepoints",
+        "filter_stationary_points",
+        "keypoint_limit",
+        "tiepoint_limit",
+        "keypoint_limit_per_mpx",
+        "keep_keypoints",
+        "guided_matching",
+        "reset_matches",
+        "subdivide_task",
+        "workitem_size_cameras",
+        "workitem_size_pairs",
+        "max_workgroup_size",
+        )),
+    "alignCameras": frozenset((
+        "cameras",
+        "min_image",
+        "adaptive_fitting",
+        "reset_alignment",
+        "subdivide_task",
+        )),
+    "optimizeCameras": frozenset((
+        "adaptive_fitting",
+        "fit_b1",
+        "fit_b2",
+        "fit_corrections",
+        "tiepoint_covariance",
+        "supports_gpu",
+        "fit_cx",
+        "fit_cy",
+        "fit_f",
+        "fit_k1",
+        "fit_k2",
+        "fit_k3",
+        "fit_k4",
+        "fit_p1",
+        "fit_p2",
+        )),
+    "buildDepthMaps": frozenset((
+        "downscale",
+        "filter_mode",
+        "cameras",
+        "reuse_depth",
+        "max_neighbors",
+        "subdivide_task",
+        "workitem_size_cameras",
+        "max_workgroup_size",
+        )),
+    "buildPointCloud": frozenset((
+        "point_colors",
+        "point_confidence",
+        "keep_depth",
+        "max_neighbors",
+        "subdivide_task",
+        "workitem_size_cameras",
+        "max_workgroup_size",
+        )),
+    "classifyGroundPoints": frozenset((
+        "max_angle",
+        "max_distance",
+        "cell_size",
+        "source",
+        )),
+    "buildModel": frozenset((
+        "surface_type",
+        "interpolation",
+        "face_count",
+        "face_count_custom",
+        "source_data",
+        "classes",
+        "vertex_colors",
+        "vertex_confidence",
+        "volumetric_masks",
+        "keep_depth",
+        "trimming_radius",
+        "subdivide_task",
+        "workitem_size_cameras",
+        "max_workgroup_size",
+        )),
+    "buildUV": frozenset((
+        "mapping_mode",
+        "page_count",
+        "adaptive_resolution",
+        "cameras",
+        )),
+    "buildTexture": frozenset((
+        "blending_mode",
+        "texture_size",
+        "fill_holes",
+        "ghosting_filter",
+        "texture_type",
+        "transfer_texture",
+        )),
+    "buildTiledModel": frozenset((
+        "pixel_size",
+        "tile_size",
+        "source_data",
+        "face_count",
+        "ghosting_filter",
+        "transfer_texture",
+        "keep_depth",
+        "classes",
+        "subdivide_task",
+        "workitem_size_cameras",
+        "max_workgroup_size",
+        )),
+    "buildDEM": frozenset((
+        "source_data",
+        "interpolation",
+        "projection",
+        "region",
+        "classes",
+        "flip_x",
+        "flip_y",
+        "flip_z",
+        "resolution",
+        "subdivide_task",
+        "workitem_size_tiles",
+        "max_workgroup_size",
+        )),
+    "buildContours": frozenset((
+        "source_data",
+        "interval",
+        "min_value",
+        "max_value",
+        "prevent_intersection",
+        )),
+    "publishData": frozenset((
+        "service",
+        "source",
+        "raster_transform",
+        "save_point_color",
+        "save_camera_track",
+        "title",
+        "description",
+        "owner",
+        "tags",
+        "username",
+        "account",
+        "token",
+        "is_draft",
+        "is_private",
+        "password",
+        "resolution",
+        "min_zoom_level",
+        )),
+    }
+
+# Stage config keys that steer the stage itself rather than being passed to Metashape
+_STAGE_OPTIONS = {
+    "addPhotos": frozenset(("photo_path", "multispectral", "remove_photo_location_metadata")),
+    "masks": frozenset(("workers",)),
+    "analyzeImages": frozenset(("quality_cutoff",)),
+    "addGCPs": frozenset(("photo_path", "gcp_crs", "marker_location_accuracy",
+                          "marker_projection_accuracy", "optimize_w_gcps_only")),
+    "alignPhotos": frozenset(("double_alignment",)),
+    "buildPointCloud": frozenset(("classify",)),
+    "filterPointCloud": frozenset(("point_confidence_max", "keep_unfiltered")),
+    }
+
+def _update_cache_file():
+    # per user, as a file left by another user in a shared temp directory cannot be overwritten
+    try:
+        user = getpass.getuser()
+    except Exception: # no user name in the environment or the password database
+        return Path(tempfile.gettempdir(), "automated_metashape_update.json")
+    return Path(tempfile.gettempdir(), f"automated_metashape_update_{user}.json")
+
+_UPDATE_CACHE_FILE = _update_cache_file()
+_UPDATE_CACHE_TTL = 86400 # seconds, i.e. check GitHub at most once a day
+
+def _warn_if_update_available(internal, tag_name, logger):
+    external = version.parse(tag_name)
+    if internal < external:
+        logger.warning(f"automated_metashape update available \n(external version: {external}). " + \
+              "Please update from https://github.com/PeterBetlem/automated_metashape/releases. " +\
+             "YAML parameters may have changed!\n")
+
+def _fetch_latest_release(internal, logger):
+    try:
+        import requests # only needed when the cached release tag is stale
+        latest = requests.get("https://api.github.com/repos/PeterBetlem/automated_metashape/releases/latest", timeout=2)
+        tag_name = latest.json()["tag_name"]
+        _warn_if_update_available(internal, tag_name, logger)
+    except:
+        logger.warning("Unable to verify remote version.")
+        return
+    try:
+        with open(_UPDATE_CACHE_FILE, "w") as file:
+            json.dump({"tag_name": tag_name}, file)
+    except OSError:
+        pass # without the cache the next run simply queries GitHub again
 
 def _check_automated_metashape_update_available(logger=logging.getLogger(__name__)):
-        internal = version.parse(pkg_resources.get_distribution('automated_metashape').version)
-        try:
-            latest = requests.get("https://api.github.com/repos/PeterBetlem/automated_metashape/releases/latest")
-            external = version.parse(latest.json()["tag_name"])
-            if internal < external:
-                logger.warning(f"automated_metashape update available \n(external version: {external}). " + \
-                      "Please update from https://github.com/PeterBetlem/automated_metashape/releases. " +\
-                     "YAML parameters may have changed!\n")
-        except:
-            logger.warning("Unable to verify remote version.")
-            pass    
+    internal = _AM_VERSION
+    try:
+        if time.time() - _UPDATE_CACHE_FILE.stat().st_mtime < _UPDATE_CACHE_TTL:
+            with open(_UPDATE_CACHE_FILE) as file:
+                tag_name = json.load(file)["tag_name"]
+            _warn_if_update_available(internal, tag_name, logger)
+            return
+    except (OSError, ValueError, KeyError):
+        pass
+    # cache missing or stale: query GitHub without holding up the run
+    threading.Thread(target=_fetch_latest_release, args=(internal, logger), daemon=True).start()
 
 def _check_metashape_version(logger=logging.getLogger(__name__)):
-    if version.parse("2.0.0") > version.parse(pkg_resources.get_distribution('Metashape').version):
+    if version.parse("2.0.0") > _MS_VERSION:
         raise  Exception("Metashape Python version > 2.0.0 required. Please update the current installation.")
 
+_STAGES = [] # (config key, method name) of pipeline stages, in execution order
+
+def _stage(key):
+    """
+    Registers the decorated AutomatedProcessing method as the pipeline stage
+    run by init_tasks when cfg[key]["enabled"] is set.
+    """
+    def register(method):
+        _STAGES.append((key, method.__name__))
+        return method
+    return register
+
 class AutomatedProcessing:
         
     def __init__(self, logger=logging.getLogger(__name__)):
-        self.__version__ = pkg_resources.get_distribution('automated_metashape').version
+        self.__version__ = __version__
         self._check_metashape_activated() # do this before doing anything else...
         self.logger = logger
+        self._invalidate_label_indexes()
 
 
         
     def read_config(self,config_file):
-        self.cfg = read_yaml(config_file)
+        # keep the raw configuration around for logging, so the file is parsed only once
+        self._config_full = load_yaml(config_file)
+        self.cfg = convert_paths_and_commands(copy.deepcopy(self._config_full))
         self.config_file = config_file
+        self._plan = None
         self.logger.info("Config file loaded.")
         
     def init_workspace(self):
@@ -111,16 +358,16 @@ class AutomatedProcessing:
         self._check_environment()
         
         if not self.cfg["project_path"].exists():
-            self.cfg["project_path"].mkdir(parents=True)
-        if not self.cfg["project_path"].exists():
-            self.cfg["project_path"].mkdir(parents=True)
+            self.cfg["project_path"].mkdir(parents=True, exist_ok=True)
         
 
     def _init_logging(self):
         # TODO: add configuration to the YML file
-        if "enable_overwrite" in self.cfg and self.cfg["enable_overwrite"] and \
-                self.cfg["load_project_path"] and self.cfg["load_project_path"].with_suffix('.log').is_file():
-            log_file_name = self.cfg["load_project_path"].resolve().with_suffix('.log')
+        load_path = self.cfg.get("load_project_path")
+        log_exists = bool(load_path) and load_path.with_suffix('.log').is_file()
+        
+        if "enable_overwrite" in self.cfg and self.cfg["enable_overwrite"] and log_exists:
+            log_file_name = load_path.resolve().with_suffix('.log')
         else:
             log_file_name = Path(self.cfg["project_path"],self.run_id+'.log')
             
@@ -143,21 +390,44 @@ class AutomatedProcessing:
                     'filename': log_file_name,
                     'class': 'logging.FileHandler',
                     'formatter': 'standard'
+                },
+                'buffered_file_handler': {
+                    # collects records in memory and writes them to the log file in batches
+                    'level': 'INFO',
+                    'class': 'logging.handlers.MemoryHandler',
+                    'capacity': 512,
+                    'flushLevel': logging.WARNING,
+                    'target': 'file_handler',
+                    'flushOnClose': True,
                 }
             },
             'loggers': {
                 '': {
-                    'handlers': ['file_handler','default'],
+                    'handlers': ['buffered_file_handler','default'],
                     'level': 'INFO',
                     'propagate': True
                 },
             }
         }
     
+        self._stop_logging() # a repeated init_workspace must not leave the old listener running
         dictConfig(log_dict)
         
+        # hand the configured handlers to a background listener so records
+        # emitted from per-camera/per-marker loops do not block on disk I/O
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        for handler in handlers:
+            root.removeHandler(handler)
+        self._log_queue = queue.Queue(-1)
+        self._log_queue_handler = QueueHandler(self._log_queue)
+        root.addHandler(self._log_queue_handler)
+        self._log_handlers = handlers
+        self._log_listener = QueueListener(self._log_queue, *handlers, respect_handler_level=True)
+        self._log_listener.start()
+        
         if "enable_overwrite" in self.cfg and self.cfg["enable_overwrite"]:
-            if self.cfg["load_project_path"] and self.cfg["load_project_path"].with_suffix('.log').is_file():
+            if log_exists:
                 self.logger.info('--------------')
                 self.logger.info('Continued run initiated.')
             else:
@@ -165,14 +435,14 @@ class AutomatedProcessing:
                 self.logger.info('Fresh run initiated.')
             
             
-        elif self.cfg["load_project_path"] and self.cfg["load_project_path"].with_suffix('.log').is_file():
-            copyfile(self.cfg["load_project_path"].with_suffix('.log'),
+        elif log_exists:
+            copyfile(load_path.with_suffix('.log'),
                   Path(self.cfg["project_path"],self.run_id+'.log')
                 )
             self.logger.info('--------------')
             self.logger.info('Continued run initiated.')
             
-        elif self.cfg["load_project_path"] and not self.cfg["load_project_path"].with_suffix('.log').is_file():
+        elif load_path:
             self.logger.info('--------------')
             self.logger.info('Unable to load original processing log. ' + \
                             'Treating as fresh run. ' + \
@@ -190,8 +460,9 @@ class AutomatedProcessing:
         _check_automated_metashape_update_available(logger = self.logger)
         
     def _return_parameters(self,stage=None,log=None):
-        with open(self.config_file) as file:
-            config_full = yaml.load(file, Loader=yaml.SafeLoader)
+        if log and not self.logger.isEnabledFor(logging.INFO):
+            return
+        config_full = self._config_full
         
         if not stage:
             config_dump = {k: v for k, v in config_full.items() if not isinstance(config_full[k],dict)}
@@ -203,7 +474,7 @@ class AutomatedProcessing:
                          yaml.dump(config_dump, default_flow_style=False)+\
                          f'### End of input file configuration for {stage}-stage ###\n'
         if log:
-            self.logger.info(parameters)
+            self.logger.info("%s", parameters)
         else:
             return parameters
         
@@ -212,6 +483,25 @@ class AutomatedProcessing:
         self.logger.info('Run completed.')
         self.logger.info('--------------\n')
         
+    def _flush_logging(self):
+        if getattr(self, "_log_listener", None):
+            self._log_queue.join() # wait until the listener has handled the queued records
+        for handler in getattr(self, "_log_handlers", []):
+            handler.flush()
+        
+    def _stop_logging(self):
+        if getattr(self, "_log_listener", None):
+            self._log_listener.stop() # flushes all queued records
+            self._log_listener = None
+            # hand the handlers back to the root logger, so records logged after
+            # the run (by the caller or the update check) are still written
+            root = logging.getLogger()
+            root.removeHandler(self._log_queue_handler)
+            for handler in self._log_handlers:
+                root.addHandler(handler)
+        for handler in getattr(self, "_log_handlers", []):
+            handler.flush() # writes the buffered run log to disk
+        
     def _check_environment(self):
         if "onedrive" in str(self.cfg["load_project_path"]).lower():
             self.logger.error("Detected OneDrive folder for project - background fileupdating causes instability. Terminating...")
@@ -220,6 +510,7 @@ class AutomatedProcessing:
     def _init_metashape_document(self):
         self.doc = Metashape.Document()
         self.doc.read_only = False
+        self._invalidate_label_indexes()
         
         if self.cfg["load_project_path"]:
             self.doc.open(str(self.cfg["load_project_path"].resolve().with_suffix('.psx').as_posix()))
@@ -256,93 +547,49 @@ class AutomatedProcessing:
         """
         
         # TODO: Add all other processing step options here as well
-                
-        if "addPhotos" in self.cfg and self.cfg["addPhotos"]["enabled"]:
-            self.add_photos()
-            
-        if "analyzeImages" in self.cfg and self.cfg["analyzeImages"]["enabled"]:
-            self.analyze_images()
-            
-        if "detectGCPs" in self.cfg and self.cfg["detectGCPs"]["enabled"]:
-            self.detect_gcps()
-        
-        if "addGCPs" in self.cfg and self.cfg["addGCPs"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["addGCPs"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.add_gcps() # call to original metashape_workflow_functions
-            
-        if "alignPhotos" in self.cfg and self.cfg["alignPhotos"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["alignPhotos"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.align_photos()
-        
-        if "optimizeCameras" in self.cfg and self.cfg["optimizeCameras"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["optimizeCameras"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.optimize_cameras()
-            
-        if "buildDepthMaps" in self.cfg and self.cfg["buildDepthMaps"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["buildDepthMaps"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.build_depth_maps()
+        cfg = self.cfg
+        if self._plan is None:
+            # the enabled stages only depend on the config, so resolve them once
+            self._plan = tuple(
+                (key, cfg[key], getattr(self, method)) for key, method in _STAGES
+                if (cfg.get(key) or {}).get("enabled")
+                )
         
-        if "buildPointCloud" in self.cfg and self.cfg["buildPointCloud"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["buildPointCloud"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.build_point_cloud()
-            
-        if "filterPointCloud" in self.cfg and self.cfg["filterPointCloud"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["filterPointCloud"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.filter_point_cloud()
-            
-        if "buildModel" in self.cfg and self.cfg["buildModel"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["buildModel"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.build_model()
-            
-        if "buildTexture" in self.cfg and self.cfg["buildTexture"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["buildTexture"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.build_texture()
-            
-        if "buildTiledModel" in self.cfg and self.cfg["buildTiledModel"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["buildTiledModel"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.build_tiled_model()
-            
-        if "buildDEM" in self.cfg and self.cfg["buildDEM"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["buildDEM"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.build_dem()
-            
-        if "buildContours" in self.cfg and self.cfg["buildContours"]["enabled"]:
-            # TODO: find a nicer way to add subdivide_task to all dicts
-            if self.cfg["subdivide_task"]: 
-                self.cfg["buildContours"]["subdivide_task"] = self.cfg["subdivide_task"]
-            self.build_contours()
-            
+        subdivide = cfg.get("subdivide_task")
+        try:
+            try:
+                # once a stage has run, the outputs of later stages are stale and must be rebuilt
+                stage_ran = bool(cfg.get("force_rerun"))
+                for key, stage_cfg, stage in self._plan:
+                    if not stage_ran and self._already_done(key):
+                        self.logger.warning(f'Skipping {key}, its output is already present in the project.')
+                        continue
+                    stage_ran = True
+                    if subdivide:
+                        stage_cfg["subdivide_task"] = subdivide
+                    # write the buffered log at every stage boundary so progress can be followed
+                    self.logger.info(f'Starting {key}.')
+                    self._flush_logging()
+                    stage()
+                    
+                self.export_report()
+            finally:
+                # single end-of-pipeline save, also covering stages without a checkpoint;
+                # in network mode the batch submission saves instead
+                if not self.network:
+                    self.doc.save()
             
-        self.export_report()
-        
-        if self.network:
-            self._network_submit_batch()
-        else:
+            if self.network:
+                self._network_submit_batch()
+            else:
+                
+                if "publishData" in self.cfg and self.cfg["publishData"]["enabled"]:
+                    self.publish_data()
             
-            if "publishData" in self.cfg and self.cfg["publishData"]["enabled"]:
-                self.publish_data()
-        
-        self._terminate_logging()
+            self._terminate_logging()
+        finally:
+            # also on failure, so the listener thread ends and the log reaches the disk
+            self._stop_logging()
             
         del self.doc
             
@@ -359,17 +606,108 @@ class AutomatedProcessing:
             encoded_task.frames.append((c.key,0))
         self.task_batch.append( encoded_task )
     
+    def _pick(self, section, operation=None):
+        '''
+        Returns the entries of cfg[section] that are valid keyword arguments
+        for the given Metashape operation (defaults to the section name).
+        '''
+        src = self.cfg[section]
+        return {k: src[k] for k in src.keys() & _ALLOWED[operation or section]}
+    
+    def _check_keys(self, section, *operations):
+        '''
+        Warns about keys in cfg[section] that are neither stage options nor
+        arguments of the given Metashape operations, as these are silently
+        dropped by _pick (e.g. typos).
+        '''
+        known = {"enabled", "subdivide_task"} | _STAGE_OPTIONS.get(section, frozenset())
+        for operation in operations:
+            known |= _ALLOWED[operation]
+        unknown = self.cfg[section].keys() - known
+        if unknown:
+            self.logger.warning(f"Ignoring unknown {section} parameters: {', '.join(sorted(unknown))}.")
+    
+    def _already_done(self, stage):
+        '''
+        Checks whether the product of stage already exists in the project.
+        init_tasks only skips the leading run of such stages in the plan; once
+        any stage has run (stages without a check here, e.g. addPhotos or
+        alignPhotos, always run) all later stages are rebuilt.
+        '''
+        chunk = self.doc.chunk
+        if stage == "buildDepthMaps":
+            return bool(chunk.depth_maps)
+        if stage == "buildPointCloud":
+            return bool(chunk.point_cloud)
+        if stage == "buildModel":
+            return bool(chunk.model)
+        if stage == "buildTexture":
+            return bool(chunk.model and chunk.model.textures)
+        if stage == "buildTiledModel":
+            return bool(chunk.tiled_model)
+        if stage == "buildDEM":
+            return bool(chunk.elevation)
+        if stage == "buildContours":
+            return bool(chunk.shapes)
+        return False
+    
+    def _maybe_save(self, stage):
+        '''
+        Saves the project only if stage is one of the configured checkpoints;
+        otherwise the changes are kept until the end-of-pipeline save.
+        '''
+        # read from the raw config, as read_yaml drops list items that are not Metashape objects
+        checkpoints = self._config_full.get("saveCheckpoints")
+        if checkpoints is None:
+            checkpoints = DEFAULT_CHECKPOINTS
+        if stage in checkpoints:
+            self.doc.save()
+    
+    def _invalidate_label_indexes(self):
+        self._marker_index = None
+        self._camera_index = None
+    
+    def _get_marker(self, label):
+        '''
+        Returns the marker with the given label, or None. The label index is
+        built on first use, keeping GCP imports linear in the number of rows.
+        '''
+        if self._marker_index is None:
+            # setdefault keeps the first marker per label, as the former linear search did
+            self._marker_index = {}
+            for marker in self.doc.chunk.markers:
+                self._marker_index.setdefault(marker.label, marker)
+        return self._marker_index.get(label)
+    
+    def _get_camera(self, label):
+        '''
+        Returns the camera with the given (case-insensitive) label, or None.
+        '''
+        if self._camera_index is None:
+            self._camera_index = {}
+            for camera in self.doc.chunk.cameras:
+                self._camera_index.setdefault(camera.label.lower(), camera)
+        return self._camera_index.get(label.lower())
+    
+    def _add_marker(self, label):
+        marker = self.doc.chunk.addMarker()
+        marker.label = label
+        if self._marker_index is not None:
+            self._marker_index.setdefault(label, marker)
+        return marker
+    
+    @_stage("addPhotos")
     def add_photos(self):
         
         # TODO: provide dictionary check to add_photos as per the other functions
         self.logger.info('Initiating add_photos step...')
-        a = glob.iglob(str(Path(self.cfg["addPhotos"]["photo_path"],"**","*.*")))   #(([jJ][pP][gG])|([tT][iI][fF]))
-        b = [path for path in a]
-        photo_files = [x for x in b if (re.search("(.tif$)|(.jpg$)|(.TIF$)|(.JPG$)",x) and (not re.search("_mask.",x)))]
+        cfg = self.cfg["addPhotos"]
+        self._check_keys("addPhotos")
+        photo_files = list(_find_photos(cfg["photo_path"]))
         
         
         ## Add them
-        if self.cfg["addPhotos"]["enabled"] and self.cfg["addPhotos"]["multispectral"]:
+        if cfg.get("multispectral"):
             self.doc.chunk.addPhotos(photo_files, layout = Metashape.MultiplaneLayout)
             self.logger.info('Photos (multispectral) added to project.')
         else:
@@ -380,39 +718,44 @@ class AutomatedProcessing:
         # TODO: Try function below
         if "masks" in self.cfg and self.cfg["masks"]["enabled"]:
             self.logger.warning('Masks are currently a semi-unsupported feature, use with caution...')
+            self._check_keys("masks", "generateMasks")
             
-            mask_dict = [
-            "path",
-            "masking_mode",
-            "mask_operation",
-            "tolerance",
-            "cameras",
-            "mask_defocus",
-            "fix_coverage",
-            "keypoint_limit",
-            "blur_threshold",
-            "mask_tiepoints",
-            ]
-            
-            mask_parameters = {}
-            for key, value in self.cfg["masks"].items():
-                if key in mask_dict:
-                    mask_parameters[key] = value 
+            mask_parameters = self._pick("masks", "generateMasks")
             
             mask_parameters["path"] = str(mask_parameters["path"].resolve())
 
             if not "cameras" in mask_parameters.keys():
-                mask_count = 0
-                for cam in self.doc.chunk.cameras:
-                    mask_parameters["cameras"] = [cam]
-                    try:
-                        self.doc.chunk.generateMasks(
-                            **mask_parameters
-                            )
-                        self.logger.debug(f'Applied mask to camera {cam}')
-                        mask_count += 1
-                    except:
-                        pass
+                mask_parameters["cameras"] = list(self.doc.chunk.cameras)
+                try:
+                    self.doc.chunk.generateMasks(
+                        **mask_parameters
+                        )
+                    mask_count = len(mask_parameters["cameras"])
+                except:
+                    # not all cameras have a mask, fall back to applying them one by one
+                    def apply_mask(cam):
+                        try:
+                            self.doc.chunk.generateMasks(
+                                **dict(mask_parameters, cameras=[cam])
+                                )
+                            self.logger.debug(f'Applied mask to camera {cam}')
+                            return 1
+                        except:
+                            return 0
+                    
+                    # reading the mask files is I/O bound; optionally overlap it across threads
+                    cameras = list(self.doc.chunk.cameras)
+                    mask_workers = self.cfg["masks"].get("workers", 1)
+                    if mask_workers > 1:
+                        with ThreadPoolExecutor(max_workers=mask_workers) as executor:
+                            applied = list(executor.map(apply_mask, cameras))
+                        # a concurrent call may fail where a sequential one succeeds, so retry those one by one
+                        failed = [cam for cam, ok in zip(cameras, applied) if not ok]
+                        mask_count = len(cameras) - len(failed) + sum(map(apply_mask, failed))
+                    else:
+                        mask_count = sum(map(apply_mask, cameras))
+                    if mask_count < len(cameras):
+                        self.logger.warning(f'No mask could be applied to {len(cameras) - mask_count} of {len(cameras)} cameras.')
             else:
                 mask_count = len(mask_parameters["cameras"])
                 self.doc.chunk.generateMasks(
@@ -423,35 +766,31 @@ class AutomatedProcessing:
             self.logger.info(f'Masks have been applied to {mask_count} cameras.'+self._return_parameters(stage="masks"))
             
         ## Need to change the label on each camera so that it includes the containing folder
+        ## and, if requested, drop the photo location metadata in the same pass
+        remove_metadata = cfg.get("remove_photo_location_metadata", False)
         for camera in self.doc.chunk.cameras:
-            path = camera.photo.path
-            path_parts = path.split("/")[-2:]
-            newlabel = "/".join(path_parts)
-            camera.label = newlabel
+            path_parts = camera.photo.path.rsplit("/", 2)[-2:]
+            camera.label = "/".join(path_parts)
+            if remove_metadata:
+                reference = camera.reference
+                reference.location = None
+                reference.rotation = None
                        
         self.logger.info('Successfully relabeled cameras.')
-            
-        if self.cfg["addPhotos"]["enabled"] and self.cfg["addPhotos"]["remove_photo_location_metadata"]:
-            for camera in self.doc.chunk.cameras:
-                camera.reference.location = None
-                camera.reference.rotation = None
-                    
+        if remove_metadata:
             self.logger.info('Removed camera reference coordinates for processing.')
             
     
-        self.doc.save()
+        self._invalidate_label_indexes() # cameras were added and relabeled
+        self._maybe_save("addPhotos")
         self.logger.info('Finalised adding photos.'+self._return_parameters(stage="addPhotos"))
 
     
+    @_stage("analyzeImages")
     def analyze_images(self):
-        analyzeImages_dict = [
-            "cameras",
-            "filter_mask"
-            ]
-        analyzeImages_parameters = []
-        for key, value in self.cfg["analyzeImages"].items():
-            if key in analyzeImages_dict:
-                analyzeImages_parameters[key] = value 
+        cfg = self.cfg["analyzeImages"]
+        self._check_keys("analyzeImages", "analyzeImages")
+        analyzeImages_parameters = self._pick("analyzeImages")
                 
         if self.network:            
             self.logger.warning("Current version do not support photo selection based on photo quality - use standalone instead.")
@@ -464,20 +803,28 @@ class AutomatedProcessing:
             self.doc.chunk.analyzeImages()
             self.logger.info('Photos analyzed.')
             
-            if "quality_cutoff" in self.cfg["analyzeImages"]:
-                self.logger.info(f"Disabling all photos with quality values less than {self.cfg['analyzeImages']['quality_cutoff']}.")
+            if "quality_cutoff" in cfg:
+                self.logger.info(f"Disabling all photos with quality values less than {cfg['quality_cutoff']}.")
             else:
-                self.cfg["analyzeImages"]["quality_cutoff"] = 0.5
+                cfg["quality_cutoff"] = 0.5
                 self.logger.info(f"Disabling all photos with quality values less than 0.5 (recommended by Agisoft).")
             
             #if not "cameras" in analyzeImages_parameters:
             #    analyzeImages_parameters["cameras"] = self.doc.chunk.cameras
                 
+            cutoff = cfg["quality_cutoff"]
+            debug = self.logger.isEnabledFor(logging.DEBUG)
+            disabled = 0
             for camera in self.doc.chunk.cameras:
-                if float(camera.meta['Image/Quality']) < self.cfg["analyzeImages"]["quality_cutoff"]:
+                quality = camera.meta['Image/Quality']
+                if quality is not None and float(quality) < cutoff:
                     camera.enabled = False
-                    self.logger.debug(f'Disabled camera {camera}')
+                    disabled += 1
+                    if debug:
+                        self.logger.debug('Disabled camera %s', camera)
+            self.logger.info(f'Disabled {disabled} cameras below the quality cutoff.')
         
+    @_stage("detectGCPs")
     def detect_gcps(self):
         '''
         Detects aruco markers and stores these in a csv file.
@@ -485,39 +832,52 @@ class AutomatedProcessing:
         to include Agisoft metashape markers.
 
         '''
+        # imported here to keep pandas out of the module import
+        from .ImageMarkers import marker_detection
+        
         #real_world_positions(self.cfg, logger=self.logger)
         marker_detection(self.cfg, logger=self.logger)
         # TODO: port real_world_position class
         
+    @_stage("addGCPs")
     def add_gcps(self):
         '''
         Add GCPs (GCP coordinates and the locations of GCPs in individual photos.
         See the helper script (and the comments therein) for details on how to prepare the data needed by this function: R/prep_gcps.R
         Alternatively, see the https://github.com/PeterBetlem/image_processing repo for automated Python processing based on aruco markers and OpenCV
         '''
+        # pandas/numpy are only needed for reading the GCP tables, defer their import cost to here
+        import pandas as pd
+        import numpy as np
         
-        self.doc.chunk.marker_crs = Metashape.CoordinateSystem(self.cfg["addGCPs"]["gcp_crs"])
+        cfg = self.cfg["addGCPs"]
+        self._check_keys("addGCPs")
+        self.doc.chunk.marker_crs = Metashape.CoordinateSystem(cfg["gcp_crs"])
 
         self.logger.info('Adding ground control points.')
         ## Tag specific pixels in specific images where GCPs are located
-        path = Path(self.cfg["addGCPs"]["photo_path"], "gcps", "prepared", "gcp_imagecoords_table.csv")
-        marker_pixel_data = pd.read_csv(path,names=["marker","camera","x","y"])
-    
-        for index, row in marker_pixel_data.iterrows():
-            camera = _get_camera(self.doc.chunk, row.camera)
+        path = Path(cfg["photo_path"], "gcps", "prepared", "gcp_imagecoords_table.csv")
+        marker_pixel_data = pd.read_csv(
+            path,
+            names=["marker","camera","x","y"],
+            dtype={"marker": "int64", "camera": str, "x": "float64", "y": "float64"},
+            )
+        
+        for row in marker_pixel_data.itertuples(index=False):
+            camera = self._get_camera(row.camera)
             if not camera:
                 print(row.camera + " camera not found in project")
                 continue
             
-            marker = _get_marker(self.doc.chunk, str(int(row.marker)))
+            label = str(row.marker)
+            marker = self._get_marker(label)
             if not marker:
-                marker = self.doc.chunk.addMarker()
-                marker.label = str(int(row.marker))
+                marker = self._add_marker(label)
                 
-            marker.projections[camera] = Metashape.Marker.Projection((float(row.x), float(row.y)), True)
+            marker.projections[camera] = Metashape.Marker.Projection((row.x, row.y), True)
     
         ## Assign real-world coordinates to each GCP
-        path = Path(self.cfg["addGCPs"]["photo_path"], "gcps", "prepared", "gcp_table.csv")
+        path = Path(cfg["photo_path"], "gcps", "prepared", "gcp_table.csv")
         
         marker_coordinate_data = pd.read_csv(path)
         marker_coordinate_data.dropna(inplace=True,axis=1)
@@ -543,36 +903,40 @@ class AutomatedProcessing:
         #    marker_coordinate_data = pd.read_csv(path,names=["marker","x","y","z"])
         #    self.logger.info("Loaded marker coordinate data without accuracies.")
         #    
-        for index, row in marker_coordinate_data.iterrows():
-            marker = _get_marker(self.doc.chunk, str(int(row.marker)))
+        has_accuracies = all([name in marker_coordinate_data.columns for name in ["dx","dy","dz"]])
+        coordinate_columns = ["x","y","z","dx","dy","dz"] if has_accuracies else ["x","y","z"]
+        marker_coordinate_data = marker_coordinate_data.astype(dict.fromkeys(coordinate_columns, "float64"))
+        for row in marker_coordinate_data.itertuples(index=False):
+            label = str(int(row.marker))
+            marker = self._get_marker(label)
             if not marker:
-                marker = self.doc.chunk.addMarker()
-                marker.label = str(int(row.marker))
+                marker = self._add_marker(label)
                 
-            marker.reference.location = (float(row.x), float(row.y), float(row.z))
+            marker.reference.location = (row.x, row.y, row.z)
             
-            if all([name in marker_coordinate_data.columns for name in ["dx","dy","dz"]]):
-                marker.reference.accuracy = (float(row.dx), float(row.dy), float(row.dz))
+            if has_accuracies:
+                marker.reference.accuracy = (row.dx, row.dy, row.dz)
             else:
                 marker.reference.accuracy = (
-                    self.cfg["addGCPs"]["marker_location_accuracy"], 
-                    self.cfg["addGCPs"]["marker_location_accuracy"], 
-                    self.cfg["addGCPs"]["marker_location_accuracy"]
+                    cfg["marker_location_accuracy"], 
+                    cfg["marker_location_accuracy"], 
+                    cfg["marker_location_accuracy"]
                     )
     
         self.doc.chunk.marker_location_accuracy = (
-            self.cfg["addGCPs"]["marker_location_accuracy"], 
-            self.cfg["addGCPs"]["marker_location_accuracy"], 
-            self.cfg["addGCPs"]["marker_location_accuracy"]
+            cfg["marker_location_accuracy"], 
+            cfg["marker_location_accuracy"], 
+            cfg["marker_location_accuracy"]
             )
-        self.doc.chunk.marker_projection_accuracy = self.cfg["addGCPs"]["marker_projection_accuracy"]
+        self.doc.chunk.marker_projection_accuracy = cfg["marker_projection_accuracy"]
         self.doc.chunk.updateTransform()
 
-        self.doc.save()
+        self._maybe_save("addGCPs")
         self.logger.info('Ground control points added.'+self._return_parameters(stage="addGCPs"))
    
         return True
         
+    @_stage("alignPhotos")
     def align_photos(self):
         """
         Create a network processing task for photo alignment, including the match
@@ -580,42 +944,10 @@ class AutomatedProcessing:
         """
         
         self.logger.info('Aligning photos...')
-        matchPhotos_dict = [
-            "downscale",
-            "generic_preselection",
-            "reference_preselection",
-            "reference_preselection_mode",
-            "filter_mask",
-            "mask_tiepoints",
-            "filter_stationary_points",
-            "keypoint_limit",
-            "tiepoint_limit",
-            "keypoint_limit_per_mpx",
-            "keep_keypoints",
-            "guided_matching",
-            "reset_matches",
-            "subdivide_task",
-            "workitem_size_cameras",
-            "workitem_size_pairs",
-            "max_workgroup_size"
-            ]
-        alignCameras_dict = [
-            "cameras",
-            "min_image",
-            "adaptive_fitting",
-            "reset_alignment",
-            "subdivide_task",
-            ]
-        
-        match_parameters = {}
-        for key, value in self.cfg["alignPhotos"].items():
-            if key in matchPhotos_dict:
-                match_parameters[key] = value 
-        
-        align_parameters = {}
-        for key, value in self.cfg["alignPhotos"].items():
-            if key in alignCameras_dict:
-                align_parameters[key] = value 
+        cfg = self.cfg["alignPhotos"]
+        self._check_keys("alignPhotos", "matchPhotos", "alignCameras")
+        match_parameters = self._pick("alignPhotos", "matchPhotos")
+        align_parameters = self._pick("alignPhotos", "alignCameras")
             
         if self.network:            
             task = Metashape.Tasks.MatchPhotos()
@@ -626,7 +958,7 @@ class AutomatedProcessing:
             task.decode(align_parameters)
             self._encode_task(task)
             
-            if self.cfg["alignPhotos"]["enabled"] and self.cfg["alignPhotos"]["double_alignment"]:
+            if cfg.get("double_alignment"):
                 self.logger.warning("Re-alignment of non-aligned photos currently only supported in non-server mode...")
                 
             self.logger.info('Photo-alignment tasks added to network batch list.'+self._return_parameters(stage="alignPhotos"))
@@ -637,9 +969,8 @@ class AutomatedProcessing:
             self.logger.info('Photos matched.')
             self.doc.chunk.alignCameras(**align_parameters
                 )
-            self.doc.save()
             
-            if self.cfg["alignPhotos"]["enabled"] and self.cfg["alignPhotos"]["double_alignment"]:
+            if cfg.get("double_alignment"):
                 align_parameters["reset_alignment"] = False
                 aligned_photos = []   # empty list
                 for camera in self.doc.chunk.cameras:
@@ -649,48 +980,32 @@ class AutomatedProcessing:
                 if len(aligned_photos)>0:
                     self.logger.info(f"Detected {len(aligned_photos)} cameras that failed alignment. Repeating alignment stage...")
                     self.doc.chunk.alignCameras(aligned_photos,**align_parameters)
-                    self.doc.save()
                     aligned_photos = []   # empty list
                     for camera in self.doc.chunk.cameras:
                         if camera.transform==None:
                             aligned_photos.append(camera)
                     
                     self.logger.info(f"{len(aligned_photos)} non-aligned cameras remain.")
+            self._invalidate_label_indexes()
+            self._maybe_save("alignPhotos")
             self.logger.info('Cameras aligned.'+self._return_parameters(stage="alignPhotos"))
             
+    @_stage("optimizeCameras")
     def optimize_cameras(self):
         '''
         Optimize cameras
         '''   
         
         self.logger.info('Optimising camera alignment...')
-        optimizeCameras_dict = [
-            "adaptive_fitting",
-            "fit_b1",
-            "fit_b2",
-            "fit_corrections",
-            "tiepoint_covariance",
-            "supports_gpu",
-            "fit_cx",
-            "fit_cy",
-            "fit_f",
-            "fit_k1",
-            "fit_k2",
-            "fit_k3",
-            "fit_k4",
-            "fit_p1",
-            "fit_p2",
-            ]
-        
-        optimize_parameters = {}
-        for key, value in self.cfg["optimizeCameras"].items():
-            if key in optimizeCameras_dict:
-                optimize_parameters[key] = value 
+        self._check_keys("optimizeCameras", "optimizeCameras")
+        optimize_parameters = self._pick("optimizeCameras")
         
         # Disable camera locations as reference if specified in YML
-        if "addGCPs" in self.cfg and self.cfg["addGCPs"]["enabled"] and self.cfg["addGCPs"]["optimize_w_gcps_only"]:
+        gcp_cfg = self.cfg.get("addGCPs") or {}
+        if gcp_cfg.get("enabled") and gcp_cfg.get("optimize_w_gcps_only"):
             self.logger.info('GCP-only optimisation enabled.')
-            for camera in self.doc.chunk.cameras:
+            cameras = self.doc.chunk.cameras
+            for camera in cameras:
                 camera.reference.enabled = False
         
         if self.network:
@@ -704,31 +1019,22 @@ class AutomatedProcessing:
             self.doc.chunk.optimizeCameras(
                 **optimize_parameters
                 )
-            self.doc.save()
+            self._maybe_save("optimizeCameras")
             self.logger.info('Optimised camera alignment.'+self._return_parameters(stage="optimizeCameras"))
             
+    @_stage("buildDepthMaps")
     def build_depth_maps(self):
         
         # TODO: consider splitting into separated depth map and Point Cloud steps
         
         self.logger.info('Generating depth maps...')
-        buildDepth_dict = [
-            "downscale",
-            "filter_mode",
-            "cameras",
-            "reuse_depth",
-            "max_neighbors",
-            "subdivide_task",
-            "workitem_size_cameras",
-            "max_workgroup_size",
-            ]
+        self._check_keys("buildDepthMaps", "buildDepthMaps")
         
-        depth_parameters = {}
-        for key, value in self.cfg["buildDepthMaps"].items():
-            if key in buildDepth_dict:
-                depth_parameters[key] = value 
+        depth_parameters = self._pick("buildDepthMaps")
                    
         if self.network:
+            # the server already splits this task into work items of workitem_size_cameras
+            # cameras and runs them concurrently on all nodes; tune those keys in the config
             task = Metashape.Tasks.BuildDepthMaps()
             task.decode(depth_parameters)
             self._encode_task(task)
@@ -737,46 +1043,26 @@ class AutomatedProcessing:
             
         else:
             self.doc.chunk.buildDepthMaps(**depth_parameters)
-            self.doc.save()
+            self._maybe_save("buildDepthMaps")
             self.logger.info('Depth maps built.')
                 
         self._return_parameters(stage="buildDepthMaps",log=True)
         
                
+    @_stage("buildPointCloud")
     def build_point_cloud(self):
         
         # TODO: consider splitting into separated depth map and Point Cloud steps
         
         self.logger.info('Generating Point Cloud...')
+        cfg = self.cfg["buildPointCloud"]
+        self._check_keys("buildPointCloud", "buildPointCloud", "classifyGroundPoints")
 
-        buildPoint_dict = [
-            "point_colors",
-            "point_confidence",
-            "keep_depth",
-            "max_neighbors",
-            "subdivide_task",
-            "workitem_size_cameras",
-            "max_workgroup_size",
-            ]
-        
-        point_parameters = {}
-        for key, value in self.cfg["buildPointCloud"].items():
-            if key in buildPoint_dict:
-                point_parameters[key] = value 
+        point_parameters = self._pick("buildPointCloud")
         # Point confidence should always be calculated!
         point_parameters["point_confidence"] = True    
         
-        classify_dict = [
-            "max_angle",
-            "max_distance",
-            "cell_size",
-            "source",
-            ]
-        
-        classify_parameters = {}
-        for key, value in self.cfg["buildPointCloud"].items():
-            if key in classify_dict:
-                classify_parameters[key] = value
+        classify_parameters = self._pick("buildPointCloud", "classifyGroundPoints")
                 
         if self.network:       
             # build Point Cloud
@@ -786,7 +1072,7 @@ class AutomatedProcessing:
             self.logger.info('Point Cloud tasks added to network batch list.')
             
             # Classify ground points
-            if "classify" in self.cfg["buildPointCloud"] and self.cfg["buildPointCloud"]["classify"]:
+            if cfg.get("classify"):
         
                 task = Metashape.Tasks.ClassifyGroundPoints()
                 task.decode(classify_parameters)
@@ -795,67 +1081,56 @@ class AutomatedProcessing:
             
         else:
             self.doc.chunk.buildPointCloud(**point_parameters)
-            self.doc.save()
             self.logger.info('Point Cloud built.')
                        
-            if "classify" in self.cfg["buildPointCloud"] and self.cfg["buildPointCloud"]["classify"]:
+            if cfg.get("classify"):
                 self.doc.chunk.point_cloud.classifyGroundPoints(**classify_parameters)
-                self.doc.save()
                 self.logger.info('Ground points classified.')
+            
+            self._maybe_save("buildPointCloud")
                 
         self._return_parameters(stage="buildPointCloud",log=True)
             
+    @_stage("filterPointCloud")
     def filter_point_cloud(self):
         '''
         Filters the Point Cloud. 
         Currently only supports local processing.
         Currently only supports point_confidence filtering
+        The Point Cloud is filtered in place; set 'keep_unfiltered' to retain
+        an unfiltered copy as well.
 
         '''
-        if self.cfg["filterPointCloud"]["point_confidence_max"]:
+        cfg = self.cfg["filterPointCloud"]
+        self._check_keys("filterPointCloud")
+        if cfg.get("point_confidence_max"):
             if self.network:
                 self.logger.warning("Point confidence for Point Clouds currently not supported through the networking interface. Parameters ignored. Try running it locally.")
             else:
-                self.logger.info(f"Removing point points with 0<confidence<{self.cfg['filterPointCloud']['point_confidence_max']}")
-                self.doc.chunk.point_cloud.label = "Point Cloud (unfiltered)"
-                original_dc = self.doc.chunk.point_cloud.copy()
-                original_dc.label = f"Point Cloud ({self.cfg['filterPointCloud']['point_confidence_max']}+ confidence)"
-                self.doc.chunk.point_cloud.setConfidenceFilter(0,self.cfg["filterPointCloud"]["point_confidence_max"])
-                self.doc.chunk.point_cloud.removePoints(list(range(128))) #removes all "visible" points of the Point Cloud
+                self.logger.info(f"Removing point points with 0<confidence<{cfg['point_confidence_max']}")
+                if cfg.get("keep_unfiltered", False):
+                    # keep an unfiltered copy of the Point Cloud next to the filtered one
+                    self.doc.chunk.point_cloud.label = "Point Cloud (unfiltered)"
+                    original_dc = self.doc.chunk.point_cloud.copy()
+                    original_dc.label = f"Point Cloud ({cfg['point_confidence_max']}+ confidence)"
+                self.doc.chunk.point_cloud.setConfidenceFilter(0,cfg["point_confidence_max"])
+                self.doc.chunk.point_cloud.removePoints(_ALL_POINT_CLASSES) #removes all "visible" points of the Point Cloud
                 self.doc.chunk.point_cloud.resetFilters()
                 
                 self._return_parameters(stage="filterPointCloud",log=True)
-                self.doc.save()
+                self._maybe_save("filterPointCloud")
         else:
             self.logger.warning("No filtering has occurred. Please configure 'filterPointCloud'/'point_confidence_max' in the cfg file...")
             
+    @_stage("buildModel")
     def build_model(self):
         '''
         Build model
         '''
         self.logger.info('Constructing a model...')
+        self._check_keys("buildModel", "buildModel")
                 
-        buildModel_dict = [
-            "surface_type",
-            "interpolation",
-            "face_count",
-            "face_count_custom",
-            "source_data",
-            "classes",
-            "vertex_colors",
-            "vertex_confidence",
-            "volumetric_masks",
-            "keep_depth",
-            "trimming_radius",
-            "subdivide_task",
-            "workitem_size_cameras",
-            "max_workgroup_size",
-            ]
-        
-        model_parameters = {}
-        for key, value in self.cfg["buildModel"].items():
-            if key in buildModel_dict:
-                model_parameters[key] = value 
+        model_parameters = self._pick("buildModel")
                 
         if self.network:
             
@@ -868,41 +1143,21 @@ class AutomatedProcessing:
 
         else:
             self.doc.chunk.buildModel(**model_parameters)
-            self.doc.save()
+            self._maybe_save("buildModel")
             self.logger.info('Model has been constructed.'+self._return_parameters(stage="buildModel"))
     
+    @_stage("buildTexture")
     def build_texture(self):
         '''
         Build UV maps and textures
         '''
         
         self.logger.info('Generating UV maps and textures...')
+        self._check_keys("buildTexture", "buildUV", "buildTexture")
                 
-        buildUV_dict = [
-            "mapping_mode",
-            "page_count",
-            "adaptive_resolution",
-            "cameras"
-            ]
-        
-        uv_parameters = {}
-        for key, value in self.cfg["buildTexture"].items():
-            if key in buildUV_dict:
-                uv_parameters[key] = value 
+        uv_parameters = self._pick("buildTexture", "buildUV")
                 
-        buildTexture_dict = [
-            "blending_mode",
-            "texture_size",
-            "fill_holes",
-            "ghosting_filter",
-            "texture_type",
-            "transfer_texture"
-            ]
-        
-        texture_parameters = {}
-        for key, value in self.cfg["buildTexture"].items():
-            if key in buildTexture_dict:
-                texture_parameters[key] = value 
+        texture_parameters = self._pick("buildTexture")
                 
         if self.network:
             
@@ -924,37 +1179,22 @@ class AutomatedProcessing:
             self.logger.info('UV map constructed.')
             
             self.doc.chunk.buildTexture(**texture_parameters)
-            self.doc.save()
+            self._maybe_save("buildTexture")
             self.logger.info('Textures constructed.'+self._return_parameters(stage="buildTexture"))
 
+    @_stage("buildTiledModel")
     def build_tiled_model(self):
         '''
         Build tiled model
         '''
         
         self.logger.info('Generating tiles for tiled model...')
+        self._check_keys("buildTiledModel", "buildTiledModel")
              
-        buildTiles_dict = [
-            "pixel_size",
-            "tile_size",
-            "source_data",
-            "face_count",
-            "ghosting_filter",
-            "transfer_texture",
-            "keep_depth",
-            "classes",
-            "subdivide_task",
-            "workitem_size_cameras",
-            "max_workgroup_size"
-            ]
-        
-        tile_parameters = {}
-        for key, value in self.cfg["buildTiledModel"].items():
-            if key in buildTiles_dict:
-                tile_parameters[key] = value 
+        tile_parameters = self._pick("buildTiledModel")
                 
         if self.network:
-            # build tiled model
+            # build tiled model, distributed over the nodes per workitem_size_cameras
             task = Metashape.Tasks.BuildTiledModel()
             task.decode(tile_parameters)
             self._encode_task(task)
@@ -962,31 +1202,46 @@ class AutomatedProcessing:
             
         else:            
             self.doc.chunk.buildTiledModel(**tile_parameters)
-            self.doc.save()
+            self._maybe_save("buildTiledModel")
             self.logger.info('Tiled model constructed.'+self._return_parameters(stage="buildTiledModel"))
 
+    @_stage("buildDEM")
+    def build_dem(self):
+        '''
+        Build dem
+        '''
+
+        self.logger.info('Generating DEM...')
+        self._check_keys("buildDEM", "buildDEM")
+
+        dem_parameters = self._pick("buildDEM")
+
+        if self.network:
+            # build dem
+            task = Metashape.Tasks.BuildDem()
+            task.decode(dem_parameters)
+            self._encode_task(task)
+            self.logger.info('DEM generation task added to network batch list.'+self._return_parameters(stage="buildDEM"))
+
+
+        else:            
+            self.doc.chunk.buildDem(**dem_parameters)
+            self._maybe_save("buildDEM")
+            self.logger.info('DEM constructed.'+self._return_parameters(stage="buildDEM"))
+
+    @_stage("buildContours")
     def build_contours(self):
         '''
         Build contours
         '''
         
         self.logger.info('Generating contours...')
+        self._check_keys("buildContours", "buildContours")
              
-        buildContours_dict = [
-            "source_data",
-            "interval",
-            "min_value",
-            "max_value",
-            "prevent_intersection",
-            ]
-        
         contours_parameters = {}
         contours_parameters["min_value"] = self.doc.chunk.elevation.min
         contours_parameters["max_value"] = self.doc.chunk.elevation.max
-        
-        for key, value in self.cfg["buildContours"].items():
-            if key in buildContours_dict:
-                contours_parameters[key] = value 
+        contours_parameters.update(self._pick("buildContours"))
                 
         if self.network:
             # build contours
@@ -997,80 +1252,18 @@ class AutomatedProcessing:
 
         else:            
             self.doc.chunk.buildContours(**contours_parameters)
-            self.doc.save()
+            self._maybe_save("buildContours")
             self.logger.info('Contours extracted.'+self._return_parameters(stage="buildContours"))
             
-        def build_dem(self):
-            '''
-            Build dem
-            '''
-
-            self.logger.info('Generating DEM...')
-
-            buildDEM_dict = [
-                "source_data",
-                "interpolation",
-                "projection",
-                "region",
-                "classes",
-                "flip_x",
-                "flip_y",
-                "flip_z",
-                "resolution",
-                "subdivide_task",
-                "workitem_size_tiles",
-                "max_workgroup_size"
-                ]
-
-            dem_parameters = {}
-            for key, value in self.cfg["buildDEM"].items():
-                if key in buildDEM_dict:
-                    dem_parameters[key] = value 
-
-            if self.network:
-                # build dem
-                task = Metashape.Tasks.BuildDem()
-                task.decode(dem_parameters)
-                self._encode_task(task)
-                self.logger.info('DEM generation task added to network batch list.'+self._return_parameters(stage="buildDEM"))
-
-
-            else:            
-                self.doc.chunk.buildDem(**dem_parameters)
-                self.doc.save()
-                self.logger.info('DEM constructed.'+self._return_parameters(stage="buildDEM"))
-
     def publish_data(self):
         """
         Function to automatically upload data to a service
 
         """
         self.logger.info('Publishing data...')
+        self._check_keys("publishData", "publishData")
              
-        publish_dict = [
-            "service",
-            "source",
-            "raster_transform",
-            "save_point_color",
-            "save_camera_track",
-            "title",
-            "description",
-            "owner",
-            "tags",
-            "username",
-            "account",
-            "token",
-            "is_draft",
-            "is_private",
-            "password",
-            "resolution",
-            "min_zoom_level"
-            ]
-        
-        publish_parameters = {}
-        for key, value in self.cfg["publishData"].items():
-            if key in publish_dict:
-                publish_parameters[key] = value 
+        publish_parameters = self._pick("publishData")
         
         if self.network:
             self.logger.error("Metashape does currently not support publishing in network mode." + \
@@ -1098,7 +1291,6 @@ class AutomatedProcessing:
                 self.logger.info(f'A processing report has been exported to {output_file}.')
             except:
                 self.logger.warning("Failed to export report. Export report manually.")
-            self.doc.save()
             
     def export_camera_metadata(self):
         """
@@ -1110,6 +1302,8 @@ class AutomatedProcessing:
         """
         Script that submits the generated task list to the network.
         """
+        # a single batch keeps the stages in order and the project is saved only
+        # before the cluster starts working on it
         self.doc.save()
         
         batch_id = self.client.createBatch(str(self.project_file.relative_to(self.network_root)), self.task_batch)
@@ -1126,16 +1320,21 @@ def stamp_time(): #  - thank you UCDavis!
     stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M')
     return stamp
 
-# Used by add_gcps function - thank you UCDavis!
-def _get_marker(chunk, label):
-    for marker in chunk.markers:
-        if marker.label == label:
-            return marker
-    return None
-
-# Used by add_gcps function - thank you UCDavis!
-def _get_camera(chunk, label):
-    for camera in chunk.cameras:
-        if camera.label.lower() == label.lower():
-            return camera
-    return None          
\ No newline at end of file
+# Used by add_photos function
+def _find_photos(directory):
+    '''
+    Yields the paths of the photos in the immediate subdirectories of directory
+    (the former photo_path/**/*.* glob, which only matched one level), skipping masks.
+    Like the glob, hidden folders and files (e.g. macOS ._ sidecars) are skipped.
+    '''
+    with os.scandir(directory) as folders:
+        for folder in folders:
+            if folder.name.startswith(".") or not folder.is_dir():
+                continue
+            with os.scandir(folder.path) as entries:
+                for entry in entries:
+                    name = entry.name.lower()
+                    if name.startswith("."):
+                        continue
+                    if entry.is_file() and name.endswith(_IMG_EXTS) and "_mask." not in name:
+                        yield entry.path
@@ -15,18 +15,15 @@ if Metashape.app.version in ['1.7']:
     
     
 
-import pkg_resources
-import distutils.dist
-import io
-
-am = pkg_resources.get_distribution('automated_metashape')
-metadata_str = am.get_metadata(am.PKG_INFO)
-metadata_obj = distutils.dist.DistributionMetadata()
-metadata_obj.read_pkg_file(io.StringIO(metadata_str))
+try:
+    from importlib.metadata import metadata as _pkg_metadata
+except ImportError: # python < 3.8
+    from importlib_metadata import metadata as _pkg_metadata
 
-__version__ = metadata_obj.version
-__author__ = metadata_obj.author
-__author_email__ = metadata_obj.author_email
-__repository__ = metadata_obj.url
-__license__ = metadata_obj.license
+metadata_obj = _pkg_metadata('automated_metashape')
 
+__version__ = metadata_obj.get('Version')
+__author__ = metadata_obj.get('Author')
+__author_email__ = metadata_obj.get('Author-email')
+__repository__ = metadata_obj.get('Home-page')
+__license__ = metadata_obj.get('License')
@@ -16,6 +16,11 @@ import yaml
 import pathlib
 import Metashape
 
+try:
+    from yaml import CSafeLoader as SafeLoader # libyaml-backed, falls back to pure python
+except ImportError:
+    from yaml import SafeLoader
+
 try:
     from cv2 import aruco
 except:
@@ -43,9 +48,13 @@ def convert_paths_and_commands(a_dict):
     return a_dict
 
 
-def read_yaml(yml_path):
+def load_yaml(yml_path):
     yml_path = pathlib.Path(yml_path)
     with open(yml_path,'r') as ymlfile:
-        cfg = yaml.load(ymlfile, Loader=yaml.SafeLoader)
-         
-    return convert_paths_and_commands(cfg)
+        cfg = yaml.load(ymlfile, Loader=SafeLoader)
+    
+    return cfg
+
+
+def read_yaml(yml_path):
+    return convert_paths_and_commands(load_yaml(yml_path))